@@ -0,0 +1,211 @@
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from collections import deque
+
+# Priority classes: lower value is served first
+PRIORITY_USER = 0
+PRIORITY_GUEST = 1
+
+# Size of the threadpool that runs sync FastAPI endpoints (main.py applies it on startup)
+THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE", "40"))
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted (queue full, per-user limit or wait timeout)."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Ticket:
+    __slots__ = ("key", "priority", "enqueued_at", "state")
+
+    def __init__(self, key, priority):
+        self.key = key
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+        self.state = "waiting"  # waiting -> admitted | evicted | expired
+
+
+class AdmissionController:
+    """
+    Bounds the number of concurrent LLM calls.
+
+    - At most `max_concurrent` calls run at once, and at most `max_per_user`
+      calls (running + waiting) belong to the same key.
+    - Extra calls wait in a bounded priority queue: logged-in users before guests,
+      FIFO within a class. When the queue is full a logged-in user evicts the
+      newest waiting guest; otherwise the caller is rejected immediately.
+    - A call that waits longer than `max_wait` seconds is rejected so that
+      admitted requests keep a predictable latency.
+
+    Sync FastAPI endpoints run in a threadpool, so waiting blocks a worker thread:
+    `max_concurrent + max_queue` must stay below `thread_limit`, otherwise queued
+    LLM calls can starve every other endpoint. Invalid limits raise ValueError.
+    """
+
+    def __init__(self, max_concurrent=8, max_per_user=2, max_queue=16, max_wait=20.0,
+                 thread_limit=THREADPOOL_SIZE):
+        if max_concurrent < 1 or max_per_user < 1 or max_queue < 0 or max_wait <= 0:
+            raise ValueError("Admission limits must be positive (max_queue may be 0)")
+        if max_concurrent + max_queue >= thread_limit:
+            raise ValueError(
+                f"max_concurrent + max_queue ({max_concurrent + max_queue}) must be below "
+                f"the threadpool size ({thread_limit})"
+            )
+        self.max_concurrent = max_concurrent
+        self.max_per_user = max_per_user
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+
+        self._cond = threading.Condition()
+        self._heap = []  # (priority, seq, ticket), only tickets still waiting
+        self._seq = itertools.count()
+        self._waiting = 0
+        self._running = 0
+        self._per_key = {}
+
+        # Metrics
+        self._admitted = 0
+        self._admitted_immediately = 0
+        self._rejected = {"queue_full": 0, "per_user_limit": 0, "timeout": 0, "evicted": 0}
+        self._queued_waits = deque(maxlen=500)  # Admitted after queueing
+        self._rejected_waits = deque(maxlen=500)  # Timed out or evicted while queued
+        self._service_times = deque(maxlen=100)
+
+    # --- Internal helpers (caller holds self._cond) ---
+
+    def _retry_after(self):
+        if self._service_times:
+            avg_service = sum(self._service_times) / len(self._service_times)
+        else:
+            avg_service = 5.0
+        backlog = (self._waiting + 1) / max(self.max_concurrent, 1)
+        return max(1, math.ceil(avg_service * backlog))
+
+    def _reject(self, reason):
+        self._rejected[reason] += 1
+        return AdmissionRejected(reason, self._retry_after())
+
+    def _release_key(self, key):
+        self._per_key[key] -= 1
+        if self._per_key[key] == 0:
+            del self._per_key[key]
+
+    def _drop(self, ticket, state):
+        # The heap holds at most max_queue entries, so a rebuild is cheap
+        ticket.state = state
+        self._heap = [entry for entry in self._heap if entry[2] is not ticket]
+        heapq.heapify(self._heap)
+        self._waiting -= 1
+
+    def _evict_newest_guest(self):
+        candidates = [entry for entry in self._heap if entry[2].priority == PRIORITY_GUEST]
+        if not candidates:
+            return False
+        newest = max(candidates, key=lambda entry: entry[1])
+        self._drop(newest[2], "evicted")
+        self._cond.notify_all()
+        return True
+
+    def _dispatch(self):
+        while self._heap and self._running < self.max_concurrent:
+            _, _, ticket = heapq.heappop(self._heap)
+            ticket.state = "admitted"
+            self._waiting -= 1
+            self._running += 1
+        self._cond.notify_all()
+
+    # --- Public API ---
+
+    def acquire(self, key, priority=PRIORITY_GUEST):
+        """Blocks until a slot is free. Returns the time spent waiting, in seconds."""
+        with self._cond:
+            if self._per_key.get(key, 0) >= self.max_per_user:
+                raise self._reject("per_user_limit")
+
+            # Fast path: free slot and nobody ahead of us
+            if self._running < self.max_concurrent and self._waiting == 0:
+                self._running += 1
+                self._per_key[key] = self._per_key.get(key, 0) + 1
+                self._admitted += 1
+                self._admitted_immediately += 1
+                return 0.0
+
+            if self._waiting >= self.max_queue:
+                if priority != PRIORITY_USER or not self._evict_newest_guest():
+                    raise self._reject("queue_full")
+
+            ticket = _Ticket(key, priority)
+            heapq.heappush(self._heap, (priority, next(self._seq), ticket))
+            self._waiting += 1
+            self._per_key[key] = self._per_key.get(key, 0) + 1
+            self._dispatch()
+
+            deadline = ticket.enqueued_at + self.max_wait
+            while ticket.state == "waiting":
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._drop(ticket, "expired")
+                    break
+                self._cond.wait(remaining)
+
+            waited = time.monotonic() - ticket.enqueued_at
+            if ticket.state != "admitted":
+                self._release_key(key)
+                self._rejected_waits.append(waited)
+                raise self._reject("timeout" if ticket.state == "expired" else "evicted")
+
+            self._admitted += 1
+            self._queued_waits.append(waited)
+            return waited
+
+    def release(self, key, service_time=None):
+        with self._cond:
+            self._running -= 1
+            self._release_key(key)
+            if service_time is not None:
+                self._service_times.append(service_time)
+            self._dispatch()
+
+    def metrics(self):
+        with self._cond:
+            return {
+                "running": self._running,
+                "queue_depth": self._waiting,
+                "max_concurrent": self.max_concurrent,
+                "max_queue": self.max_queue,
+                "admitted_total": self._admitted,
+                "admitted_immediately": self._admitted_immediately,
+                "rejected_total": dict(self._rejected),
+                # Waits of requests that had to queue; rejected ones waited and still got a 429
+                "queued_wait_seconds": _summarize(self._queued_waits),
+                "rejected_wait_seconds": _summarize(self._rejected_waits),
+            }
+
+
+def _summarize(samples):
+    waits = sorted(samples)
+    if not waits:
+        return {"count": 0, "avg": 0.0, "p95": 0.0, "max": 0.0}
+    return {
+        "count": len(waits),
+        "avg": round(sum(waits) / len(waits), 3),
+        "p95": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 3),
+        "max": round(waits[-1], 3),
+    }
+
+
+# Shared controller for all LLM-bound endpoints
+controller = AdmissionController(
+    max_concurrent=int(os.getenv("LLM_MAX_CONCURRENT", "8")),
+    max_per_user=int(os.getenv("LLM_MAX_PER_USER", "2")),
+    max_queue=int(os.getenv("LLM_MAX_QUEUE", "16")),
+    max_wait=float(os.getenv("LLM_MAX_WAIT_SECONDS", "20")),
+)
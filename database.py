@@ -1,9 +1,20 @@
 import sqlite3
 import json
+import hmac
+import hashlib
+import os
+import secrets
+import time
 from datetime import datetime
 
 DB_NAME = "pathfinder.db"
 
+# Signs login tokens. Without AUTH_SECRET a per-process key is used, so tokens only verify on the
+# process that issued them and stop verifying after a restart.
+AUTH_SECRET_IS_SET = bool(os.getenv("AUTH_SECRET"))
+AUTH_SECRET = os.getenv("AUTH_SECRET") or secrets.token_hex(32)
+AUTH_TOKEN_MAX_AGE = int(os.getenv("AUTH_TOKEN_MAX_AGE", str(7 * 24 * 3600)))  # seconds
+
 def init_db():
     conn = sqlite3.connect(DB_NAME)
     c = conn.cursor()
@@ -39,6 +50,40 @@ def login_user(username, password):
     conn.close()
     return user is not None
 
+def user_exists(username):
+    conn = sqlite3.connect(DB_NAME)
+    c = conn.cursor()
+    c.execute("SELECT 1 FROM users WHERE username=?", (username,))
+    user = c.fetchone()
+    conn.close()
+    return user is not None
+
+def _sign(payload):
+    return hmac.new(AUTH_SECRET.encode(), payload.encode(), hashlib.sha256).hexdigest()
+
+def create_auth_token(username, issued_at=None):
+    payload = f"{username}:{int(time.time() if issued_at is None else issued_at)}"
+    return f"{payload}:{_sign(payload)}"
+
+def verify_auth_token(token):
+    """
+    Returns the username a token was issued to, or None if it is malformed, tampered with,
+    older than AUTH_TOKEN_MAX_AGE or issued to a user that no longer exists.
+    """
+    if not token or token.count(":") < 2:
+        return None
+    payload, signature = token.rsplit(":", 1)
+    username, issued_at = payload.rsplit(":", 1)
+    try:
+        if not hmac.compare_digest(signature.encode(), _sign(payload).encode()):
+            return None
+        age = time.time() - int(issued_at)
+    except ValueError:  # Non-ASCII/unencodable characters or a non-numeric timestamp
+        return None
+    if age < -60 or age > AUTH_TOKEN_MAX_AGE:  # Small allowance for clock skew between hosts
+        return None
+    return username if user_exists(username) else None
+
 def save_message(username, thread_id, role, message):
     conn = sqlite3.connect(DB_NAME)
     c = conn.cursor()
@@ -1,15 +1,34 @@
-from fastapi import FastAPI, HTTPException
+import os
+import time
+from contextlib import contextmanager, asynccontextmanager
+import anyio.to_thread
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import Optional, List, Dict
 from langchain_core.messages import HumanMessage, AIMessage
 
 from agent.graph import app as agent_app
-from database import init_db, register_user, login_user, save_message, get_history, get_user_threads
+from database import (init_db, register_user, login_user, save_message, get_history, get_user_threads,
+                      create_auth_token, verify_auth_token, AUTH_SECRET_IS_SET)
+from admission import controller as admission, AdmissionRejected, PRIORITY_USER, PRIORITY_GUEST, THREADPOOL_SIZE
 
 init_db()
 
-app = FastAPI()
+# Only honour X-Forwarded-For when the server sits behind a proxy that sets it
+TRUST_PROXY = os.getenv("TRUST_PROXY", "").lower() in ("1", "true", "yes")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Tokens signed with a per-process key only verify on the worker that issued them
+    # (WEB_CONCURRENCY is read by gunicorn and uvicorn; `uvicorn --workers` is not detectable here)
+    if int(os.getenv("WEB_CONCURRENCY", "1")) > 1 and not AUTH_SECRET_IS_SET:
+        raise RuntimeError("AUTH_SECRET must be set when running more than one worker")
+    # Keep the sync-endpoint threadpool in step with the admission limits (validated in admission.py)
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+    yield
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -17,6 +36,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After"],
 )
 
 # In-memory storage for Guests
@@ -30,6 +50,7 @@ class ChatRequest(BaseModel):
     message: str
     thread_id: str
     username: Optional[str] = None
+    token: Optional[str] = None
 
 class HistoryRequest(BaseModel):
     username: str
@@ -37,6 +58,38 @@ class HistoryRequest(BaseModel):
 
 class QuizRequest(BaseModel):
     topic: str
+    token: Optional[str] = None
+
+
+def client_ip(request: Request):
+    if TRUST_PROXY:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            # The last hop is the one appended by our proxy; earlier entries are client-controlled
+            return forwarded.split(",")[-1].strip()
+    return request.client.host if request.client else "unknown"
+
+@contextmanager
+def llm_slot(request: Request, token: Optional[str]):
+    """Admission control for LLM calls: holders of a valid login token get priority, guests are keyed by client IP."""
+    username = verify_auth_token(token)
+    if username:
+        key, priority = f"user:{username}", PRIORITY_USER
+    else:
+        key, priority = f"guest:{client_ip(request)}", PRIORITY_GUEST
+    try:
+        admission.acquire(key, priority)
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=429,
+            detail=f"Server busy ({e.reason}), please retry later",
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        admission.release(key, time.monotonic() - started)
 
 @app.post("/register")
 def register(req: AuthRequest):
@@ -47,7 +100,7 @@ def register(req: AuthRequest):
 @app.post("/login")
 def login(req: AuthRequest):
     if login_user(req.username, req.password):
-        return {"status": "success", "username": req.username}
+        return {"status": "success", "username": req.username, "token": create_auth_token(req.username)}
     return {"status": "error", "message": "Invalid credentials"}
 
 # --- NEW: Get list of previous sessions ---
@@ -64,9 +117,13 @@ def get_history_endpoint(req: HistoryRequest):
     history = [{"role": r[0], "content": r[1]} for r in rows]
     return {"history": history}
 
+@app.get("/metrics/admission")
+def admission_metrics():
+    return admission.metrics()
+
 
 @app.post("/chat")
-def chat_endpoint(req: ChatRequest):
+def chat_endpoint(req: ChatRequest, request: Request):
     try:
         messages = []
         if req.username:
@@ -82,11 +139,12 @@ def chat_endpoint(req: ChatRequest):
         messages.append(HumanMessage(content=req.message))
 
         # FIX: Pass both messages and message field to the agent
-        result = agent_app.invoke({
-            "messages": messages,
-            "message": req.message,
-            "user_message": req.message
-        })
+        with llm_slot(request, req.token):
+            result = agent_app.invoke({
+                "messages": messages,
+                "message": req.message,
+                "user_message": req.message
+            })
 
         data = result.get("final_response", {})
         reply = data.get("chat_message", "")
@@ -105,20 +163,25 @@ def chat_endpoint(req: ChatRequest):
             guest_store[req.thread_id].append(AIMessage(content=reply))
 
         return {"reply": reply, "plan": plan, "status": "success"}
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error: {e}")
         return {"reply": "Error processing request", "status": "error"}
 
 
 @app.post("/quiz")
-def quiz_endpoint(req: QuizRequest):
+def quiz_endpoint(req: QuizRequest, request: Request):
     from langchain_openai import ChatOpenAI
     from agent.schemas import QuizData
     try:
         llm = ChatOpenAI(model="gpt-4o", temperature=0)
         structured_llm = llm.with_structured_output(QuizData)
-        quiz = structured_llm.invoke(f"Create a 5-question quiz for: {req.topic}")
+        with llm_slot(request, req.token):
+            quiz = structured_llm.invoke(f"Create a 5-question quiz for: {req.topic}")
         return quiz.dict()
+    except HTTPException:
+        raise
     except Exception as e:
         return {"error": str(e)}
 
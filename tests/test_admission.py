@@ -0,0 +1,178 @@
+import threading
+import time
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected, PRIORITY_USER, PRIORITY_GUEST
+
+
+def wait_for(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not reached")
+        time.sleep(0.005)
+
+
+class Waiter(threading.Thread):
+    """Queues on the controller in a background thread and records the outcome."""
+
+    def __init__(self, controller, key, priority, order=None):
+        super().__init__(daemon=True)
+        self.controller = controller
+        self.key = key
+        self.priority = priority
+        self.order = order
+        self.admitted = threading.Event()
+        self.release = threading.Event()
+        self.error = None
+
+    def run(self):
+        try:
+            self.controller.acquire(self.key, self.priority)
+        except AdmissionRejected as e:
+            self.error = e
+            return
+        if self.order is not None:
+            self.order.append(self.key)
+        self.admitted.set()
+        self.release.wait(2.0)
+        self.controller.release(self.key)
+
+
+def start_waiter(controller, key, priority, order=None):
+    depth = controller.metrics()["queue_depth"]
+    waiter = Waiter(controller, key, priority, order)
+    waiter.start()
+    wait_for(lambda: controller.metrics()["queue_depth"] == depth + 1)
+    return waiter
+
+
+def assert_drained(controller):
+    metrics = controller.metrics()
+    assert metrics["running"] == 0
+    assert metrics["queue_depth"] == 0
+    assert controller._per_key == {}
+
+
+def test_user_admitted_ahead_of_earlier_guest():
+    controller = AdmissionController(max_concurrent=1, max_queue=2, max_wait=2.0, thread_limit=10)
+    controller.acquire("holder")
+    order = []
+    guest = start_waiter(controller, "guest:1", PRIORITY_GUEST, order)
+    user = start_waiter(controller, "user:a", PRIORITY_USER, order)
+
+    controller.release("holder")
+    assert user.admitted.wait(1.0)
+    user.release.set()
+    assert guest.admitted.wait(1.0)
+    guest.release.set()
+    user.join()
+    guest.join()
+
+    assert order == ["user:a", "guest:1"]
+    assert_drained(controller)
+
+
+def test_full_queue_user_evicts_newest_guest_and_guest_is_rejected():
+    controller = AdmissionController(max_concurrent=1, max_queue=2, max_wait=2.0, thread_limit=10)
+    controller.acquire("holder")
+    older = start_waiter(controller, "guest:1", PRIORITY_GUEST)
+    newest = start_waiter(controller, "guest:2", PRIORITY_GUEST)
+
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.acquire("guest:3", PRIORITY_GUEST)
+    assert rejected.value.reason == "queue_full"
+    assert rejected.value.retry_after >= 1
+
+    user = Waiter(controller, "user:a", PRIORITY_USER)
+    user.start()
+    newest.join(1.0)
+    assert newest.error is not None and newest.error.reason == "evicted"
+    assert controller.metrics()["queue_depth"] == 2
+
+    controller.release("holder")
+    for waiter in (user, older):
+        assert waiter.admitted.wait(1.0)
+        waiter.release.set()
+        waiter.join()
+
+    metrics = controller.metrics()
+    assert metrics["rejected_total"]["queue_full"] == 1
+    assert metrics["rejected_total"]["evicted"] == 1
+    assert metrics["rejected_wait_seconds"]["count"] == 1
+    assert_drained(controller)
+
+
+def test_timeout_after_max_wait():
+    controller = AdmissionController(max_concurrent=1, max_queue=2, max_wait=0.1, thread_limit=10)
+    controller.acquire("holder")
+
+    started = time.monotonic()
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.acquire("guest:1", PRIORITY_GUEST)
+    assert rejected.value.reason == "timeout"
+    assert time.monotonic() - started >= 0.1
+
+    metrics = controller.metrics()
+    assert metrics["rejected_wait_seconds"]["max"] >= 0.1
+    assert metrics["queued_wait_seconds"]["count"] == 0
+
+    controller.release("holder")
+    assert_drained(controller)
+
+
+def test_expired_guests_leave_heap_while_users_wait():
+    controller = AdmissionController(max_concurrent=1, max_queue=4, max_wait=0.05, thread_limit=10)
+    controller.acquire("holder")
+    controller.max_wait = 2.0
+    user = start_waiter(controller, "user:a", PRIORITY_USER)
+    controller.max_wait = 0.05
+
+    for i in range(10):
+        with pytest.raises(AdmissionRejected):
+            controller.acquire(f"guest:{i}", PRIORITY_GUEST)
+        assert len(controller._heap) == controller.metrics()["queue_depth"] == 1
+
+    controller.release("holder")
+    assert user.admitted.wait(1.0)
+    user.release.set()
+    user.join()
+    assert controller._heap == []
+    assert_drained(controller)
+
+
+def test_per_user_limit_counts_running_and_queued():
+    controller = AdmissionController(max_concurrent=1, max_per_user=2, max_queue=2, max_wait=2.0,
+                                     thread_limit=10)
+    controller.acquire("user:a", PRIORITY_USER)
+    queued = start_waiter(controller, "user:a", PRIORITY_USER)
+
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.acquire("user:a", PRIORITY_USER)
+    assert rejected.value.reason == "per_user_limit"
+
+    controller.release("user:a")
+    assert queued.admitted.wait(1.0)
+    queued.release.set()
+    queued.join()
+    assert_drained(controller)
+
+
+def test_immediate_admissions_do_not_skew_wait_metrics():
+    controller = AdmissionController(max_concurrent=2, max_queue=2, thread_limit=10)
+    controller.acquire("guest:1")
+    controller.release("guest:1")
+
+    metrics = controller.metrics()
+    assert metrics["admitted_total"] == 1
+    assert metrics["admitted_immediately"] == 1
+    assert metrics["queued_wait_seconds"]["count"] == 0
+    assert_drained(controller)
+
+
+def test_limits_must_fit_threadpool():
+    with pytest.raises(ValueError):
+        AdmissionController(max_concurrent=8, max_queue=32, thread_limit=40)
+    with pytest.raises(ValueError):
+        AdmissionController(max_concurrent=0)
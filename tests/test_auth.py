@@ -0,0 +1,36 @@
+import pytest
+
+import database
+
+
+@pytest.fixture(autouse=True)
+def temp_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DB_NAME", str(tmp_path / "test.db"))
+    database.init_db()
+    database.register_user("bob", "secret")
+
+
+def test_token_round_trip():
+    assert database.verify_auth_token(database.create_auth_token("bob")) == "bob"
+
+
+@pytest.mark.parametrize("token", [None, "", "bob", "bob:é", "bob:1:é", "bob:abc:deadbeef", "\ud800:1:x"])
+def test_malformed_token_is_rejected(token):
+    assert database.verify_auth_token(token) is None
+
+
+def test_tampered_token_is_rejected():
+    username, issued_at, signature = database.create_auth_token("bob").split(":")
+    assert database.verify_auth_token(f"alice:{issued_at}:{signature}") is None
+    assert database.verify_auth_token(f"bob:{int(issued_at) + 1}:{signature}") is None
+    flipped = ("0" if signature[0] != "0" else "1") + signature[1:]
+    assert database.verify_auth_token(f"bob:{issued_at}:{flipped}") is None
+
+
+def test_token_for_unknown_user_is_rejected():
+    assert database.verify_auth_token(database.create_auth_token("ghost")) is None
+
+
+def test_expired_token_is_rejected():
+    issued_at = database.time.time() - database.AUTH_TOKEN_MAX_AGE - 1
+    assert database.verify_auth_token(database.create_auth_token("bob", issued_at)) is None
@@ -0,0 +1,75 @@
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("langgraph")
+
+import database
+from admission import AdmissionController
+
+
+@pytest.fixture
+def main(tmp_path, monkeypatch):
+    # main.py builds the agent and initialises the database at import time
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    monkeypatch.setattr(database, "DB_NAME", str(tmp_path / "test.db"))
+    import main
+    main.init_db()
+    return main
+
+
+def make_request(host="10.0.0.1", headers=None):
+    return SimpleNamespace(client=SimpleNamespace(host=host), headers=headers or {})
+
+
+def test_client_ip_ignores_forwarded_for_by_default(main, monkeypatch):
+    monkeypatch.setattr(main, "TRUST_PROXY", False)
+    request = make_request(headers={"x-forwarded-for": "1.1.1.1, 2.2.2.2"})
+    assert main.client_ip(request) == "10.0.0.1"
+
+
+def test_client_ip_uses_last_forwarded_hop_behind_trusted_proxy(main, monkeypatch):
+    monkeypatch.setattr(main, "TRUST_PROXY", True)
+    assert main.client_ip(make_request(headers={"x-forwarded-for": "1.1.1.1, 2.2.2.2"})) == "2.2.2.2"
+    assert main.client_ip(make_request()) == "10.0.0.1"
+
+
+def test_llm_slot_keys_by_verified_token(main, monkeypatch):
+    controller = AdmissionController(max_concurrent=2, max_queue=2, thread_limit=10)
+    monkeypatch.setattr(main, "admission", controller)
+    database.register_user("bob", "secret")
+
+    with main.llm_slot(make_request(), database.create_auth_token("bob")):
+        assert controller._per_key == {"user:bob": 1}
+    with main.llm_slot(make_request(), "bob:é"):
+        assert controller._per_key == {"guest:10.0.0.1": 1}
+    assert controller._per_key == {}
+
+
+def test_llm_slot_releases_when_call_raises(main, monkeypatch):
+    controller = AdmissionController(max_concurrent=1, max_queue=1, thread_limit=10)
+    monkeypatch.setattr(main, "admission", controller)
+
+    with pytest.raises(RuntimeError):
+        with main.llm_slot(make_request(), None):
+            raise RuntimeError("LLM failed")
+    assert controller.metrics()["running"] == 0
+    assert controller._per_key == {}
+
+
+def test_chat_returns_429_with_retry_after_when_busy(main, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    controller = AdmissionController(max_concurrent=1, max_queue=0, thread_limit=10)
+    monkeypatch.setattr(main, "admission", controller)
+    controller.acquire("holder")
+
+    with TestClient(main.app) as client:
+        response = client.post("/chat", json={"message": "hi", "thread_id": "guest_1"},
+                               headers={"Origin": "http://example.com"})
+
+    assert response.status_code == 429
+    assert int(response.headers["retry-after"]) >= 1
+    assert "retry-after" in response.headers["access-control-expose-headers"].lower()
+    controller.release("holder")